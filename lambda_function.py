@@ -1,22 +1,38 @@
+# Imported first so the import time of everything below can be profiled.
+from utils.profiling import record_import_time, profile_invocation, profile_thread, phase
+
 import os
-import random
-from datetime import datetime, date
+from datetime import datetime, date, time, timedelta, timezone
 import logging
-from collections import defaultdict
+import threading
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
 
 from slack_bolt import App
 from slack_bolt.adapter.aws_lambda import SlackRequestHandler
 from slack_bolt.authorization import AuthorizeResult
+from slack_sdk import WebClient
 
-from utils.messages import chats_scheduled_channel_message, chats_scheduled_dm_message, ask_if_chat_happened_message
-from utils.database import Database
+from utils.messages import (
+    chats_scheduled_channel_message,
+    chats_scheduled_dm_message,
+    ask_if_chat_happened_message,
+    paused_due_to_inactivity_message
+)
+from utils.client_pool import ClientPool
+from utils.pairing import get_recent_unmet_pairs, close_round, filter_users, pair_users
 from utils.slack_helpers import (
     get_member_channels,
     get_channel_info,
+    get_user_info,
     get_channel_users, 
     get_group_channel, 
     set_channel_topic,
     send_message,
+    send_messages,
+    schedule_message,
+    schedule_messages,
+    delete_scheduled_messages,
     authenticate_new_install,
     respond_to_http_call
 )
@@ -24,32 +40,56 @@ from utils.slack_helpers import (
 
 logging.basicConfig(level=logging.INFO)
 
+# Number of coffee chats in a row a user can miss before being paused.
+MAX_MISSED_INTROS = int(os.environ.get('MAX_MISSED_INTROS', 2))
+
+# Number of days before the pairing date to plan the round and schedule the intro messages (0 sends them on the day).
+# Planning has to happen after the engagement survey, which goes out a week before the pairing date.
+PRESCHEDULE_DAYS = int(os.environ.get('PRESCHEDULE_DAYS', 0))
+if not 0 <= PRESCHEDULE_DAYS < 7:
+    raise ValueError(f'PRESCHEDULE_DAYS must be between 0 and 6, got {PRESCHEDULE_DAYS}')
+
+# Time of day the intro messages go out, matching the EventBridge schedule.
+PAIRING_TIME = time(13, tzinfo=timezone.utc)
 
-# Initialize the Bolt app with your bot token and signing secret
-db = Database(table_prefix=os.environ.get("TABLE_PREFIX"))
-access_token = db.get_access_token(os.environ.get("SLACK_TEAM_ID"))
+# Number of workspaces to run the scheduled event for in parallel.
+TEAM_WORKERS = int(os.environ.get('TEAM_WORKERS', 4))
+
+
+# Use a local SQLite database if configured, DynamoDB otherwise.
+if os.environ.get("SQLITE_PATH"):
+    from utils.sqlite_database import SQLiteDatabase
+    db = SQLiteDatabase(os.environ.get("SQLITE_PATH"))
+else:
+    from utils.database import Database
+    db = Database(table_prefix=os.environ.get("TABLE_PREFIX"))
+
+# Initialize the Bolt app with your signing secret, bot tokens are looked up per workspace.
+clients = ClientPool(db.get_access_token, max_size=int(os.environ.get('CLIENT_POOL_SIZE', 100)))
 
 def authorize(enterprise_id, team_id, user_id):
-    if team_id == os.environ.get("SLACK_TEAM_ID"):
+    bot_token = clients.get_token(team_id)
+    if bot_token:
         return AuthorizeResult(
             enterprise_id=enterprise_id,
             team_id=team_id,
-            bot_token=db.get_access_token(team_id)
+            bot_token=bot_token
         )
     else:
         raise Exception(f"Unauthorized workspace: {team_id}")
 
 app = App(
-    token=access_token,
     signing_secret=os.environ.get("SLACK_SIGNING_SECRET"),
     authorize=authorize,
     process_before_response=True 
 )
 
+record_import_time()
+
 
 
 @app.command('/coffee_chat')
-def handle_command(ack, body, logger):
+def handle_command(ack, body, client, logger):
     ack()
     print(f"Command received: {body}")
     
@@ -60,7 +100,7 @@ def handle_command(ack, body, logger):
     user = body['user_id']
     
     print(body)
-    channel_info = get_channel_info(app.client, channel)
+    channel_info = get_channel_info(client, channel)
     response_type = 'ephemeral'
 
     if channel_info.get('is_mpim') or not channel_info.get('is_member'):
@@ -72,14 +112,16 @@ def handle_command(ack, body, logger):
     elif argument == 'resume':
         next_pairing_date = db.get_next_pairing_date(channel)
         db.resume_intros(channel, user)
+        db.add_user_to_planned_intros(channel, user)
         response_message = f'Coffee chats have been resumed for you in <#{channel}>. You will be included in the next round on {next_pairing_date.strftime("%b %-d")}!'
     elif argument in ('set biweekly', 'set triweekly'):
         db.get_or_update_channel_settings(channel, frequency=argument.split()[1])
         response_message = f'<@{user}> set coffee chats in <#{channel}> to {argument.split()[1]}.'
         response_type = 'in_channel'
         next_pairing_date = db.get_next_pairing_date(channel)
-        set_channel_topic(app.client, channel, f'Next coffee chats: {next_pairing_date.strftime("%b %-d")}')
-
+        set_channel_topic(client, channel, f'Next coffee chats: {next_pairing_date.strftime("%b %-d")}')
+        # Intros planned for the old pairing date no longer apply.
+        _cancel_planned_intros(client, channel)
     
     else:
         response_message = 'Unknown command. Must be either `/coffee_chat pause` or `/coffee_chat resume`.'
@@ -89,6 +131,7 @@ def handle_command(ack, body, logger):
     respond_to_http_call(response_url, response_message, response_type)
 
 
+
 @app.action('meeting_happened')
 @app.action('meeting_did_not_happen')
 @app.action('meeting_will_happen')
@@ -122,125 +165,207 @@ def handle_command(ack, body, logger):
 
 
 @app.event('member_joined_channel')
-def handle_member_joined_channel(event, say):
+def handle_member_joined_channel(event, say, client):
     user_joined = event.get('user')
     channel = event.get('channel')
-    bot_user = app.client.auth_test()['user_id']
+    bot_user = client.auth_test()['user_id']
     print(f'{user_joined} joined {channel}.')
 
     if user_joined == bot_user:
         db.get_or_update_channel_settings(channel, new_add=True)
         next_pairing_date = db.get_next_pairing_date(channel)
         say(channel=channel, text=f'Hi, I will facilitate coffee chats in this channel! :coffee:\n\nThe first round will go out on *Monday* ({next_pairing_date.strftime("%b %-d")}).')
+    elif PRESCHEDULE_DAYS:
+        # Include new members in a round that has already been planned.
+        user_info = get_user_info(client, user_joined)
+        if user_info and not user_info.get('is_bot'):
+            db.add_user_to_planned_intros(channel, user_joined)
         
 
 
 
-def randomize_users(users: list[str]) -> list[list[str]]:
-    random.shuffle(users)
-
-    two_person_chats = users[:len(users)//2]
-    three_person_chats = users[len(users)//2:]
-
-    coffee_chats = []
-    leftovers = []
-
-    for i in range(0, len(three_person_chats), 3):
-        coffee_chat = three_person_chats[i:i+3]
-        if len(coffee_chat) == 3:
-            coffee_chats.append(coffee_chat)
-        else:
-            leftovers.extend(coffee_chat)
+def _get_intros_stats(intro: dict) -> dict:
+    if not intro or not intro['is_active']:
+        return None
     
-    for i in range(0, len(two_person_chats), 2):
-        coffee_chat = two_person_chats[i:i+2]
-        if len(coffee_chat) == 2:
-            coffee_chats.append(coffee_chat)
-        else:
-            leftovers.extend(coffee_chat)
-
-    if len(leftovers) == 1:
-        coffee_chats[-1].extend(leftovers)
-    if len(leftovers) > 1:
-        coffee_chats.append(leftovers)
+    return {
+        'intros_count': len(intro['intros']),
+        'meetings_count': sum([m['happened'] for m in intro['intros'].values()])
+    }
 
-    return coffee_chats
 
-
-def _pair_users(channel, ice_breaker_question) -> None:
+def _pair_users(client: WebClient, channel, ice_breaker_question, pairing_date: date = None) -> None:
 
     # Get users to pair.
-    users = get_channel_users(app.client, channel)
-    paused_users = db.get_paused_intros(channel)
-    print(f'Users in channel: {len(users)}')
-    print(f'Paused users: {len(paused_users)}')
-    users = [u for u in users if u not in paused_users]
-
-    # Calculate stats for previous intro.
-    recent_intros = db.load_recent_intros(channel)
-    if recent_intros and recent_intros[0]['is_active']:
-        previous_intros_stats = {
-            'intros_count': len(recent_intros[0]['intros']),
-            'meetings_count': sum([m['happened'] for m in recent_intros[0]['intros'].values()])
-        }
-    else:
-        previous_intros_stats = None
-        
-    # Determine which users need to be skipped due to inactivity.
-    recent_paired_users = set()
-    missed_intros = defaultdict(int)
-    for round in recent_intros:
-        for intro in round['intros'].values():
-            if intro['happened']:
-                continue
-            recent_paired_users.add(tuple(sorted(intro['users'])))
-            for user in intro['users']:
-                missed_intros[user] += 1
+    with phase('roster_fetch'):
+        users = get_channel_users(client, channel)
+        print(f'Users in channel: {len(users)}')
+
+        # Calculate stats for previous intro.
+        recent_intros = db.load_recent_intros(channel)
+        previous_intros_stats = _get_intros_stats(recent_intros[0] if recent_intros else None)
     
-    skipped_users = []
-    for user in users:
-        if missed_intros[user] >= 2:
-            db.pause_intros(channel, user)
-            send_message(app.client, user, {'text': f'Coffee chats have been paused for you in <#{channel}> due to inactivity (missing your last two coffee chats). To be included in the next round, run `/coffee_chat resume` in the channel at any time.'})
-            skipped_users.append(user)
-            
-    users = [u for u in users if u not in skipped_users]
-            
+    if pairing_date:
+        # When planning ahead, the previous round is still open and is only closed when the planned
+        # intros are sent. Inactive users are kept in the plan, since the filter_users on the pairing
+        # date only sees the planned users and those added since, and pauses and notifies them there.
+        with phase('roster_fetch'):
+            paused_users = set(db.get_paused_intros(channel))
+            users = [u for u in users if u not in paused_users]
+    else:
+        # Close the previous round, then skip paused users and pause users due to inactivity.
+        with phase('db_writes'):
+            close_round(db, channel, recent_intros)
+        with phase('roster_fetch'):
+            users, skipped_users = filter_users(db, channel, users, MAX_MISSED_INTROS)
+        with phase('db_writes'):
+            db.pause_intros_for_users(channel, skipped_users)
+        print(f'Paused due to inactivity: {len(skipped_users)}')
+
+        with phase('dispatch'):
+            send_messages(client, [(user, paused_due_to_inactivity_message(channel, MAX_MISSED_INTROS)) for user in skipped_users])
+
     # Randomize users.
     print(f'{len(users)} to pair.')
     if len(users) < 2:
         logging.warning(f'Too few users in {channel}')
         return
-    paired_users = randomize_users(users)
-
-    # Try again if repeat match.
-    repeat_match = False
-    for user_pair in paired_users:
-        if tuple(sorted(user_pair)) in recent_paired_users:
-            repeat_match = True
-            break
-    if repeat_match:
-        paired_users = randomize_users(users)
+    with phase('pairing'):
+        paired_users = pair_users(users, get_recent_unmet_pairs(recent_intros))
     
+    # Open group channels.
+    with phase('dispatch'):
+        paired_group_channels = []
+        for user_pair in paired_users:
+            paired_group_channels.append(get_group_channel(client, ','.join(user_pair)))
+
+    intro_messages = [
+        (group_channel, chats_scheduled_dm_message(channel, len(user_pair), ice_breaker_question['question']))
+        for user_pair, group_channel in zip(paired_users, paired_group_channels)
+    ]
+
+    # Queue intro messages to go out at the pairing time.
+    if pairing_date:
+        post_at = int(datetime.combine(pairing_date, PAIRING_TIME).timestamp())
+        with phase('dispatch'):
+            scheduled_message_ids = schedule_messages(client, intro_messages, post_at)
+        with phase('db_writes'):
+            db.save_planned_intros(channel, pairing_date.isoformat(), paired_users, paired_group_channels, ice_breaker_question, scheduled_message_ids)
+        return
+
     # Send intro messages.
-    paired_group_channels = []
-    for user_pair in paired_users:
-        paired_group_channels.append(get_group_channel(app.client, ','.join(user_pair)))
+    with phase('db_writes'):
+        db.save_intros(channel, paired_users, paired_group_channels, ice_breaker_question)
+    with phase('dispatch'):
+        send_messages(client, intro_messages)
+        _announce_intros(client, channel, len(paired_users), previous_intros_stats)
+
+
+def _send_planned_intros(client: WebClient, channel, planned_intros: dict) -> None:
+    
+    with phase('roster_fetch'):
+        recent_intros = db.load_recent_intros(channel)
+        previous_intros_stats = _get_intros_stats(recent_intros[0] if recent_intros else None)
+    
+    # Close the previous round now that its survey is over, and pause inactive users.
+    intros = dict(planned_intros['intros'])
+    planned_users = [u for intro in intros.values() for u in intro['users']]
+    added_users = [u for u in dict.fromkeys(planned_intros.get('added_users', [])) if u not in planned_users]
+    with phase('db_writes'):
+        close_round(db, channel, recent_intros)
+    with phase('roster_fetch'):
+        users, skipped_users = filter_users(db, channel, planned_users + added_users, MAX_MISSED_INTROS)
+    with phase('db_writes'):
+        db.pause_intros_for_users(channel, skipped_users)
+    with phase('dispatch'):
+        send_messages(client, [(user, paused_due_to_inactivity_message(channel, MAX_MISSED_INTROS)) for user in skipped_users])
+    
+    # Re-plan only the groups with users that were paused since planning, together with users that resumed or joined.
+    users = set(users)
+    replanned_intros = {gc: intro for gc, intro in intros.items() if not all(u in users for u in intro['users'])}
+    leftover_users = [u for intro in replanned_intros.values() for u in intro['users'] if u in users] + [u for u in added_users if u in users]
+    if len(leftover_users) == 1 and len(replanned_intros) < len(intros):
+        group_channel = next(gc for gc in intros if gc not in replanned_intros)
+        replanned_intros[group_channel] = intros[group_channel]
+        leftover_users.extend(intros[group_channel]['users'])
+    
+    if replanned_intros:
+        print(f'Re-planning {len(replanned_intros)} groups')
+        with phase('dispatch'):
+            delete_scheduled_messages(client, [
+                (group_channel, intro['scheduled_message_id'])
+                for group_channel, intro in replanned_intros.items()
+                if intro['scheduled_message_id']
+            ])
+        for group_channel in replanned_intros:
+            del intros[group_channel]
+        if len(leftover_users) >= 2:
+            with phase('pairing'):
+                replanned_users = pair_users(leftover_users, get_recent_unmet_pairs(recent_intros))
+            with phase('dispatch'):
+                for user_pair in replanned_users:
+                    intros[get_group_channel(client, ','.join(user_pair))] = {'users': user_pair, 'scheduled_message_id': None}
+    
+    with phase('db_writes'):
+        db.delete_planned_intros(channel)
+    if not intros:
+        logging.warning(f'Too few users in {channel}')
+        return
+    
+    paired_group_channels = list(intros.keys())
+    paired_users = [intro['users'] for intro in intros.values()]
+    with phase('db_writes'):
+        db.save_intros(channel, paired_users, paired_group_channels, planned_intros['ice_breaker'])
+    
+    # Queue intro messages that could not be scheduled or were re-planned, and the announcement, to go out
+    # with the scheduled ones. They're sent right away if the pairing time has already passed.
+    post_at = int(datetime.combine(date.fromisoformat(planned_intros['date']), PAIRING_TIME).timestamp())
+    if post_at <= datetime.now(timezone.utc).timestamp() + 60:
+        post_at = None
+    intro_messages = [
+        (group_channel, chats_scheduled_dm_message(channel, len(intro['users']), planned_intros['ice_breaker']['question']))
+        for group_channel, intro in intros.items()
+        if not intro['scheduled_message_id']
+    ]
+    with phase('dispatch'):
+        if post_at:
+            schedule_messages(client, intro_messages, post_at)
+        else:
+            send_messages(client, intro_messages)
+
+        _announce_intros(client, channel, len(paired_users), previous_intros_stats, post_at)
+
+
+def _cancel_planned_intros(client: WebClient, channel) -> None:
+
+    planned_intros = db.get_planned_intros(channel)
+    if not planned_intros:
+        return
+    
+    print(f'Cancelling intros planned for {planned_intros["date"]}')
+    delete_scheduled_messages(client, [
+        (group_channel, intro['scheduled_message_id'])
+        for group_channel, intro in planned_intros['intros'].items()
+        if intro['scheduled_message_id']
+    ])
+    db.delete_planned_intros(channel)
 
-    db.save_intros(channel, paired_users, paired_group_channels, ice_breaker_question)
 
-    for user_pair, group_channel in zip(paired_users, paired_group_channels):
-        schedule_coffee_chat_message = chats_scheduled_dm_message(channel, len(user_pair), ice_breaker_question['question'])
-        send_message(app.client, group_channel, schedule_coffee_chat_message)
+def _announce_intros(client: WebClient, channel, n_pairs: int, previous_intros_stats: dict, post_at: int = None) -> None:
 
+    # The topic can't be scheduled, so it's updated right away.
     next_pairing_date = db.get_next_pairing_date(channel)
-    set_channel_topic(app.client, channel, f'Next coffee chats: {next_pairing_date.strftime("%b %-d")}')
+    set_channel_topic(client, channel, f'Next coffee chats: {next_pairing_date.strftime("%b %-d")}')
     
-    send_message(app.client, channel, chats_scheduled_channel_message(len(paired_users), previous_intros_stats))
+    message = chats_scheduled_channel_message(n_pairs, previous_intros_stats)
+    if post_at:
+        schedule_message(client, channel, message, post_at)
+    else:
+        send_message(client, channel, message)
     
 
 
-def _ask_for_engagement(channel) -> None:
+def _ask_for_engagement(client: WebClient, channel) -> None:
 
     active_intro = db.get_active_intro(channel)
     if not active_intro:
@@ -250,38 +375,87 @@ def _ask_for_engagement(channel) -> None:
     db.get_or_update_channel_settings(channel, last_engagement_asked_dt=datetime.today().date().isoformat())
     for group_channel, users in active_intro['intros'].items(): 
         send_message(
-            app.client, 
+            client, 
             group_channel,
             ask_if_chat_happened_message(channel)
         )
 
 
-def _execute_scheduled_event(overwrite_today: date = None) -> None:
+def _execute_scheduled_event(client: WebClient, overwrite_today: date = None, claim_channel: Callable[[str], bool] = None) -> None:
 
     ice_breaker_question = None
     
-    for channel in get_member_channels(app.client):
+    for channel in get_member_channels(client):
         
         print(f':: {channel} ::')
         
+        # Channels shared between installed workspaces (Slack Connect) are only handled once per run.
+        if claim_channel and not claim_channel(channel):
+            print('Already handled for another workspace')
+            continue
+        
         today = overwrite_today or datetime.today().date()
         next_pairing_date = db.get_next_pairing_date(channel)
         next_engagement_survey_date = db.get_next_engagement_survey_date(channel)
         print(f'Next pairing date: {next_pairing_date}')
         
         if today == next_pairing_date:
+            planned_intros = db.get_planned_intros(channel)
+            if planned_intros and planned_intros['date'] == today.isoformat():
+                print('Sending planned pairing')
+                _send_planned_intros(client, channel, planned_intros)
+                continue
+            _cancel_planned_intros(client, channel)
+            
             print('Pairing users')
             if ice_breaker_question is None:
                 ice_breaker_question = db.get_ice_breaker_question()
-            _pair_users(channel, ice_breaker_question)
-        elif today == next_engagement_survey_date:
+            _pair_users(client, channel, ice_breaker_question)
+            continue
+        
+        if today == next_engagement_survey_date:
             print('Asking for engagement')
-            _ask_for_engagement(channel)
+            _ask_for_engagement(client, channel)
+        elif PRESCHEDULE_DAYS and today == next_pairing_date - timedelta(days=PRESCHEDULE_DAYS):
+            print('Scheduling pairing')
+            _cancel_planned_intros(client, channel)
+            if ice_breaker_question is None:
+                ice_breaker_question = db.get_ice_breaker_question()
+            _pair_users(client, channel, ice_breaker_question, pairing_date=next_pairing_date)
         else:
             print('Nothing to do')
 
 
 
+def _execute_scheduled_events(overwrite_today: date = None) -> None:
+
+    processed_channels = set()
+    processed_channels_lock = threading.Lock()
+
+    def claim_channel(channel):
+        with processed_channels_lock:
+            if channel in processed_channels:
+                return False
+            processed_channels.add(channel)
+            return True
+
+    @profile_thread
+    def execute_for_team(team):
+        print(f':: Team {team} ::')
+        client = clients.get_client(team)
+        if not client:
+            logging.warning(f'No access token for {team}')
+            return
+        try:
+            _execute_scheduled_event(client, overwrite_today, claim_channel)
+        except Exception:
+            logging.exception(f'Scheduled event failed for {team}')
+
+    with ThreadPoolExecutor(max_workers=TEAM_WORKERS) as executor:
+        list(executor.map(execute_for_team, db.get_installed_teams()))
+
+
+@profile_invocation
 def lambda_handler(event, context):
     
     print(event)
@@ -293,15 +467,15 @@ def lambda_handler(event, context):
         # Dev event.
         if event.get('force_pairing'):
             db.get_or_update_channel_settings('C051N2XP2NS', frequency='triweekly', last_coffee_chat_dt='2024-10-07')
-            _execute_scheduled_event(overwrite_today=date(2024, 10, 7))
+            _execute_scheduled_events(overwrite_today=date(2024, 10, 7))
             return
         if event.get('force_ask_for_engagement'):
             db.get_or_update_channel_settings('C051N2XP2NS', frequency='triweekly', last_coffee_chat_dt='2024-10-07', last_engagement_asked_dt='2024-10-21')
-            _execute_scheduled_event(overwrite_today=date(2024, 10, 21))
+            _execute_scheduled_events(overwrite_today=date(2024, 10, 21))
             return
         
         # Scheduled event
-        _execute_scheduled_event()
+        _execute_scheduled_events()
         return
         
     # Authenticate new app install.
@@ -310,6 +484,7 @@ def lambda_handler(event, context):
         auth_response = authenticate_new_install(auth_code)
         if auth_response['authentication'] == 'Authentification successful':
             db.save_access_token(auth_response['team_id'], auth_response['access_token'])
+            clients.invalidate(auth_response['team_id'])
             return {'statusCode': 200, 'body': auth_response['authentication']}
         else:
             return {'statusCode': 400}
@@ -0,0 +1,160 @@
+import os
+import argparse
+import importlib
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from itertools import combinations
+
+from utils.pairing import randomize_users, get_recent_unmet_pairs, close_round, filter_users, pair_users
+from utils.sqlite_database import SQLiteDatabase
+
+
+FREQUENCY_DAYS = {'biweekly': 14, 'triweekly': 21}
+
+
+def load_strategy(path: str):
+    module, function = path.split(':')
+    return getattr(importlib.import_module(module), function)
+
+
+def simulate_channel(db: SQLiteDatabase, channel: str, n_users: int, n_rounds: int, frequency: str = 'triweekly', strategy=randomize_users, max_missed_intros: int = 2, min_engagement: float = 0.1, max_engagement: float = 0.6, resume_probability: float = 0.2, trace_memory: bool = True) -> dict:
+
+    users = [f'{channel}-U{i}' for i in range(n_users)]
+
+    # Engagement is the weekly chance of a user meeting their group, so longer rounds give more chances to meet.
+    weeks_per_round = FREQUENCY_DAYS[frequency] // 7
+    weekly_engagement = {user: random.uniform(min_engagement, max_engagement) for user in users}
+    engagement = {user: 1 - (1 - p) ** weeks_per_round for user, p in weekly_engagement.items()}
+    ice_breaker_question = {'question_id': -1, 'question': ''}
+
+    seen_pairs = set()
+    partners = defaultdict(set)
+    group_sizes = Counter()
+    pairs_count = 0
+    repeat_pairs_count = 0
+    paused_count = 0
+    pairing_times = []
+    round_times = []
+    round_peaks = []
+
+    db.get_or_update_channel_settings(channel, new_add=True, frequency=frequency)
+    start_date = date(2024, 1, 1)
+
+    for round_number in range(n_rounds):
+        round_date = start_date + timedelta(days=round_number * FREQUENCY_DAYS[frequency])
+
+        if trace_memory:
+            tracemalloc.start()
+        start_time = time.perf_counter()
+
+        # Same steps as _pair_users, without the Slack calls.
+        recent_intros = db.load_recent_intros(channel)
+        close_round(db, channel, recent_intros)
+        users_to_pair, skipped_users = filter_users(db, channel, users, max_missed_intros)
+        db.pause_intros_for_users(channel, skipped_users)
+        if len(users_to_pair) < 2:
+            paired_users = []
+        else:
+            paired_users = pair_users(users_to_pair, get_recent_unmet_pairs(recent_intros), strategy)
+        paired_group_channels = [f'{channel}-G{round_number}-{i}' for i in range(len(paired_users))]
+        db.save_intros(channel, paired_users, paired_group_channels, ice_breaker_question, current_date=round_date.isoformat())
+
+        pairing_times.append(time.perf_counter() - start_time)
+        if trace_memory:
+            round_peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        # Collect pairing quality.
+        paused_count += len(skipped_users)
+        for user_pair in paired_users:
+            group_sizes[len(user_pair)] += 1
+            for pair in combinations(sorted(user_pair), 2):
+                pairs_count += 1
+                if pair in seen_pairs:
+                    repeat_pairs_count += 1
+                seen_pairs.add(pair)
+                partners[pair[0]].add(pair[1])
+                partners[pair[1]].add(pair[0])
+
+        # Groups meet with the average engagement of their members.
+        for user_pair, group_channel in zip(paired_users, paired_group_channels):
+            if random.random() < statistics.mean(engagement[u] for u in user_pair):
+                db.update_intro_happened(channel, group_channel, True)
+
+        # Some paused users come back.
+        for user in db.get_paused_intros(channel):
+            if random.random() < resume_probability:
+                db.resume_intros(channel, user)
+
+        round_times.append(time.perf_counter() - start_time)
+
+    return {
+        'users': n_users,
+        'rounds': n_rounds,
+        'repeat_pair_rate': repeat_pairs_count / pairs_count if pairs_count else 0,
+        'group_sizes': dict(sorted(group_sizes.items())),
+        'partner_coverage': statistics.mean(len(partners[u]) for u in users) / (n_users - 1) if n_users > 1 else 0,
+        'inactivity_pauses': paused_count,
+        'pairing_ms_per_round': statistics.mean(pairing_times) * 1000,
+        'total_ms_per_round': statistics.mean(round_times) * 1000,
+        'peak_kib_per_round': statistics.mean(round_peaks) / 1024 if round_peaks else None,
+    }
+
+
+def print_report(results: list[dict]) -> None:
+    # Pairing time and memory cover the steps of _pair_users, total time also includes the simulated answers and resumes.
+    print(f'{"users":>7} {"rounds":>6} {"repeats":>8} {"coverage":>9} {"pauses":>7} {"pair ms":>8} {"total ms":>9} {"pair KiB":>9}  group sizes')
+    for r in results:
+        peak = f'{r["peak_kib_per_round"]:9.1f}' if r['peak_kib_per_round'] is not None else f'{"-":>9}'
+        group_sizes = ', '.join(f'{size}: {count}' for size, count in r['group_sizes'].items())
+        print(f'{r["users"]:>7} {r["rounds"]:>6} {r["repeat_pair_rate"]:>8.1%} {r["partner_coverage"]:>9.1%} {r["inactivity_pauses"]:>7} {r["pairing_ms_per_round"]:>8.1f} {r["total_ms_per_round"]:>9.1f} {peak}  {group_sizes}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate rounds of coffee chats offline to measure pairing quality and runtime.')
+    parser.add_argument('--users', type=int, nargs='+', default=[10, 100, 1000, 10000], help='Channel sizes to simulate.')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--frequency', choices=FREQUENCY_DAYS.keys(), default='triweekly', help='Round interval, which sets how many weeks users have to meet.')
+    parser.add_argument('--strategy', default='utils.pairing:randomize_users', help='Pairing function as module:function.')
+    parser.add_argument('--max-missed-intros', type=int, default=2)
+    parser.add_argument('--min-engagement', type=float, default=0.1, help='Lowest weekly probability of a user meeting their group.')
+    parser.add_argument('--max-engagement', type=float, default=0.6, help='Highest weekly probability of a user meeting their group.')
+    parser.add_argument('--resume-probability', type=float, default=0.2, help='Probability of a paused user resuming each round.')
+    parser.add_argument('--database', help='New SQLite file to keep the simulated data in (defaults to a temporary file).')
+    parser.add_argument('--no-memory', action='store_true', help='Skip tracemalloc, which slows down the rounds.')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    # Channels and dates repeat between runs, so reusing a database would mix the results.
+    if args.database and os.path.exists(args.database):
+        parser.error(f'{args.database} already exists')
+
+    random.seed(args.seed)
+    strategy = load_strategy(args.strategy)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = SQLiteDatabase(args.database or f'{tmp_dir}/simulation.db')
+        results = [
+            simulate_channel(
+                db, f'C{n_users}', n_users, args.rounds,
+                frequency=args.frequency,
+                strategy=strategy,
+                max_missed_intros=args.max_missed_intros,
+                min_engagement=args.min_engagement,
+                max_engagement=args.max_engagement,
+                resume_probability=args.resume_probability,
+                trace_memory=not args.no_memory
+            )
+            for n_users in dict.fromkeys(args.users)
+        ]
+
+    print_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta
+
+
+class BaseDatabase(ABC):
+    
+    # Storage methods implemented by each backend (DynamoDB, SQLite).
+    
+    @abstractmethod
+    def get_access_token(self, team: str) -> str:
+        pass
+    
+    @abstractmethod
+    def save_access_token(self, team: str, access_token: str):
+        pass
+    
+    @abstractmethod
+    def get_installed_teams(self) -> list[str]:
+        pass
+    
+    @abstractmethod
+    def get_channel_settings(self, channel: str) -> dict:
+        pass
+    
+    @abstractmethod
+    def save_channel_settings(self, channel_metadata: dict) -> None:
+        pass
+    
+    @abstractmethod
+    def get_ice_breaker_question(self) -> dict:
+        pass
+    
+    @abstractmethod
+    def get_active_intro(self, channel: str) -> dict:
+        pass
+    
+    @abstractmethod
+    def save_intros(self, channel: str, paired_users: list[list[str]], paired_group_channels: list[str], ice_breaker: dict, current_date: str = None):
+        pass
+    
+    @abstractmethod
+    def load_recent_intros(self, channel) -> list:
+        pass
+    
+    @abstractmethod
+    def update_intro_happened(self, channel: str, group_channel: str, happened: bool) -> str:
+        pass
+    
+    @abstractmethod
+    def save_planned_intros(self, channel: str, pairing_date: str, paired_users: list[list[str]], paired_group_channels: list[str], ice_breaker: dict, scheduled_message_ids: list[str]):
+        pass
+    
+    @abstractmethod
+    def get_planned_intros(self, channel: str) -> dict:
+        pass
+    
+    @abstractmethod
+    def add_user_to_planned_intros(self, channel: str, user: str):
+        pass
+    
+    @abstractmethod
+    def delete_planned_intros(self, channel: str):
+        pass
+    
+    @abstractmethod
+    def record_intro_outcomes(self, channel: str, intro: dict) -> None:
+        pass
+    
+    @abstractmethod
+    def get_missed_intros(self, channel: str) -> dict:
+        pass
+    
+    @abstractmethod
+    def get_inactive_users(self, channel: str, min_missed_count: int) -> list[str]:
+        pass
+    
+    @abstractmethod
+    def pause_intros(self, channel: str, user: str):
+        pass
+    
+    @abstractmethod
+    def pause_intros_for_users(self, channel: str, users: list[str]):
+        pass
+    
+    @abstractmethod
+    def resume_intros(self, channel: str, user: str):
+        pass
+    
+    @abstractmethod
+    def get_paused_intros(self, channel: str):
+        pass
+    
+    
+    # Scheduling logic shared by all backends.
+    
+    def get_or_update_channel_settings(self, channel: str, new_add: bool = False, frequency: str = None, last_coffee_chat_dt: str = None, last_engagement_asked_dt: str = None) -> dict:
+
+        if new_add:
+            channel_metadata = None
+        else:
+            channel_metadata = self.get_channel_settings(channel)
+        
+        if channel_metadata and not frequency and not last_coffee_chat_dt and not last_engagement_asked_dt:
+            return channel_metadata
+        
+        if not channel_metadata:
+            channel_metadata = {
+                'channel': channel, 
+                'added_dt': datetime.today().strftime('%Y-%m-%d'),
+                'frequency': 'triweekly',
+                'is_active': True,
+                'last_coffee_chat_dt': None,
+                'last_engagement_asked_dt': None
+            }
+        
+        if frequency:
+            channel_metadata['frequency'] = frequency
+            
+        if last_coffee_chat_dt:
+            channel_metadata['last_coffee_chat_dt'] = last_coffee_chat_dt
+            
+        if last_engagement_asked_dt:
+            channel_metadata['last_engagement_asked_dt'] = last_engagement_asked_dt
+        
+        self.save_channel_settings(channel_metadata)
+        
+        return channel_metadata
+        
+        
+    def get_next_pairing_date(self, channel: str) -> date:
+        channel_metadata = self.get_or_update_channel_settings(channel)
+        last_coffee_chat_dt = channel_metadata['last_coffee_chat_dt']
+        channel_added_dt = channel_metadata['added_dt']
+        pairing_frequency = channel_metadata['frequency']
+        
+        next_pairing_date = None
+        if not channel_metadata['is_active']:
+            next_pairing_date = date(9999, 12, 31)
+        elif last_coffee_chat_dt and pairing_frequency == 'biweekly':
+            next_pairing_date = datetime.fromisoformat(last_coffee_chat_dt).date() + timedelta(days=14)
+        elif last_coffee_chat_dt and pairing_frequency == 'triweekly':
+            next_pairing_date = datetime.fromisoformat(last_coffee_chat_dt).date() + timedelta(days=21)
+        elif last_coffee_chat_dt:
+            raise Exception('Unexpected frequency:', pairing_frequency)
+        else:
+            next_pairing_date = max(
+                datetime.fromisoformat(channel_added_dt).date() + timedelta(days=7),
+                datetime.now().date() + timedelta(days=6)
+            )
+        
+        # Set to Monday.
+        next_pairing_date = next_pairing_date - timedelta(days=next_pairing_date.weekday())
+            
+        return next_pairing_date
+    
+    def get_next_engagement_survey_date(self, channel: str) -> date:
+        next_pairing_date = self.get_next_pairing_date(channel)
+        next_engagement_survey_date = next_pairing_date - timedelta(7)
+        last_engagement_survey_date = datetime.fromisoformat(self.get_or_update_channel_settings(channel)['last_engagement_asked_dt'] or '9999-12-31').date()
+        if next_engagement_survey_date == last_engagement_survey_date:
+            print('Already did survey for this round')
+            next_engagement_survey_date = date(9999, 12, 31)
+        return next_engagement_survey_date
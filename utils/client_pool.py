@@ -0,0 +1,44 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from slack_sdk import WebClient
+
+
+class ClientPool(object):
+    
+    def __init__(self, get_access_token: Callable[[str], Optional[str]], max_size: int = 100):
+        self.get_access_token = get_access_token
+        self.max_size = max_size
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_client(self, team: str) -> WebClient:
+        with self._lock:
+            if team in self._clients:
+                self._clients.move_to_end(team)
+                return self._clients[team]
+        
+        # Look up the token outside the lock so a slow database call doesn't block other teams.
+        token = self.get_access_token(team)
+        if not token:
+            return None
+        
+        with self._lock:
+            client = self._clients.setdefault(team, WebClient(token=token))
+            self._clients.move_to_end(team)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+            
+            return client
+    
+    def get_token(self, team: str) -> str:
+        client = self.get_client(team)
+        if client:
+            return client.token
+        
+        return None
+    
+    def invalidate(self, team: str) -> None:
+        with self._lock:
+            self._clients.pop(team, None)
@@ -1,17 +1,50 @@
 import boto3
 import logging
-from datetime import date, datetime, timedelta
+import threading
+from datetime import datetime
 
+from utils.base_database import BaseDatabase
 
-class Database(object):
+
+class Database(BaseDatabase):
     
     def __init__(self, table_prefix=''):
-        self.dynamodb = boto3.resource('dynamodb')
-        self.access_tokens = self.dynamodb.Table(f'{table_prefix}access_tokens')
-        self.channels = self.dynamodb.Table(f'{table_prefix}channels')
-        self.intros = self.dynamodb.Table(f'{table_prefix}intros')
-        self.ice_breaker_questions = self.dynamodb.Table(f'{table_prefix}ice_breaker_questions')
-        self.paused_users = self.dynamodb.Table(f'{table_prefix}paused_users')
+        self.table_prefix = table_prefix
+        self._local = threading.local()
+    
+    def _table(self, name: str):
+        # boto3 resources are not thread safe, so every thread gets its own.
+        if not hasattr(self._local, 'dynamodb'):
+            self._local.dynamodb = boto3.session.Session().resource('dynamodb')
+        return self._local.dynamodb.Table(f'{self.table_prefix}{name}')
+    
+    @property
+    def access_tokens(self):
+        return self._table('access_tokens')
+    
+    @property
+    def channels(self):
+        return self._table('channels')
+    
+    @property
+    def intros(self):
+        return self._table('intros')
+    
+    @property
+    def ice_breaker_questions(self):
+        return self._table('ice_breaker_questions')
+    
+    @property
+    def paused_users(self):
+        return self._table('paused_users')
+    
+    @property
+    def missed_intros(self):
+        return self._table('missed_intros')
+    
+    @property
+    def planned_intros(self):
+        return self._table('planned_intros')
     
     
     def get_active_intro(self, channel: str) -> dict:
@@ -55,6 +88,15 @@ class Database(object):
         )['Items']
         if items:
             return items[0]['token']
+    
+    def get_installed_teams(self) -> list[str]:
+        response = self.access_tokens.scan(ProjectionExpression='team')
+        items = response['Items']
+        while 'LastEvaluatedKey' in response:
+            response = self.access_tokens.scan(ProjectionExpression='team', ExclusiveStartKey=response['LastEvaluatedKey'])
+            items.extend(response['Items'])
+        
+        return [i['team'] for i in items]
             
 
     
@@ -72,75 +114,9 @@ class Database(object):
         return None
         
         
-    def get_or_update_channel_settings(self, channel: str, new_add: bool = False, frequency: str = None, last_coffee_chat_dt: str = None, last_engagement_asked_dt: str = None) -> dict:
-
-        if new_add:
-            channel_metadata = None
-        else:
-            channel_metadata = self.get_channel_settings(channel)
-        
-        if channel_metadata and not frequency and not last_coffee_chat_dt and not last_engagement_asked_dt:
-            return channel_metadata
-        
-        if not channel_metadata:
-            channel_metadata = {
-                'channel': channel, 
-                'added_dt': datetime.today().strftime('%Y-%m-%d'),
-                'frequency': 'triweekly',
-                'is_active': True,
-                'last_coffee_chat_dt': None,
-                'last_engagement_asked_dt': None
-            }
-        
-        if frequency:
-            channel_metadata['frequency'] = frequency
-            
-        if last_coffee_chat_dt:
-            channel_metadata['last_coffee_chat_dt'] = last_coffee_chat_dt
-            
-        if last_engagement_asked_dt:
-            channel_metadata['last_engagement_asked_dt'] = last_engagement_asked_dt
-        
+    def save_channel_settings(self, channel_metadata: dict) -> None:
         self.channels.put_item(Item=channel_metadata) 
         
-        return channel_metadata
-        
-        
-    def get_next_pairing_date(self, channel: str) -> date:
-        channel_metadata = self.get_or_update_channel_settings(channel)
-        last_coffee_chat_dt = channel_metadata['last_coffee_chat_dt']
-        channel_added_dt = channel_metadata['added_dt']
-        pairing_frequency = channel_metadata['frequency']
-        
-        next_pairing_date = None
-        if not channel_metadata['is_active']:
-            next_pairing_date = date(9999, 12, 31)
-        elif last_coffee_chat_dt and pairing_frequency == 'biweekly':
-            next_pairing_date = datetime.fromisoformat(last_coffee_chat_dt).date() + timedelta(days=14)
-        elif last_coffee_chat_dt and pairing_frequency == 'triweekly':
-            next_pairing_date = datetime.fromisoformat(last_coffee_chat_dt).date() + timedelta(days=21)
-        elif last_coffee_chat_dt:
-            raise Exception('Unexpected frequency:', pairing_frequency)
-        else:
-            next_pairing_date = max(
-                datetime.fromisoformat(channel_added_dt).date() + timedelta(days=7),
-                datetime.now().date() + timedelta(days=6)
-            )
-        
-        # Set to Monday.
-        next_pairing_date = next_pairing_date - timedelta(days=next_pairing_date.weekday())
-            
-        return next_pairing_date
-    
-    def get_next_engagement_survey_date(self, channel: str) -> date:
-        next_pairing_date = self.get_next_pairing_date(channel)
-        next_engagement_survey_date = next_pairing_date - timedelta(7)
-        last_engagement_survey_date = datetime.fromisoformat(self.get_or_update_channel_settings(channel)['last_engagement_asked_dt'] or '9999-12-31').date()
-        if next_engagement_survey_date == last_engagement_survey_date:
-            print('Already did survey for this round')
-            next_engagement_survey_date = date(9999, 12, 31)
-        return next_engagement_survey_date
-        
             
     def get_ice_breaker_question(self) -> dict:
 
@@ -168,9 +144,9 @@ class Database(object):
         return {'question_id': -1, 'question': ''}
     
 
-    def save_intros(self, channel: str, paired_users: list[list[str]], paired_group_channels: list[str], ice_breaker: dict):
+    def save_intros(self, channel: str, paired_users: list[list[str]], paired_group_channels: list[str], ice_breaker: dict, current_date: str = None):
         table = self.intros
-        current_date = datetime.today().date().isoformat()
+        current_date = current_date or datetime.today().date().isoformat()
         
         # Set previous intros as inactive.
         active_intro = self.get_active_intro(channel)
@@ -196,6 +172,56 @@ class Database(object):
             }
         }) 
 
+    def save_planned_intros(self, channel: str, pairing_date: str, paired_users: list[list[str]], paired_group_channels: list[str], ice_breaker: dict, scheduled_message_ids: list[str]):
+        self.planned_intros.put_item(Item={
+            'channel': channel,
+            'date': pairing_date,
+            'ice_breaker': {
+                'question_id': ice_breaker['question_id'],
+                'question': ice_breaker['question']
+            },
+            'intros': {
+                group_channel: {
+                    'users': users,
+                    'scheduled_message_id': scheduled_message_id
+                }
+                for users, group_channel, scheduled_message_id in zip(paired_users, paired_group_channels, scheduled_message_ids)
+            }
+        })
+
+    def get_planned_intros(self, channel: str) -> dict:
+        items = self.planned_intros.query(
+            KeyConditionExpression='channel = :channel',
+            ExpressionAttributeValues={
+                ':channel': channel
+            }
+        )['Items']
+        
+        if items:
+            return items[0]
+        
+        return None
+
+    def add_user_to_planned_intros(self, channel: str, user: str):
+        try:
+            self.planned_intros.update_item(
+                Key={'channel': channel},
+                UpdateExpression='SET added_users = list_append(if_not_exists(added_users, :empty), :user)',
+                ConditionExpression='attribute_exists(channel)',
+                ExpressionAttributeValues={
+                    ':empty': [],
+                    ':user': [user]
+                }
+            )
+        except self.planned_intros.meta.client.exceptions.ConditionalCheckFailedException:
+            # No intros planned for the channel.
+            return
+
+    def delete_planned_intros(self, channel: str):
+        self.planned_intros.delete_item(Key={
+            'channel': channel
+        })
+
     def load_recent_intros(self, channel) -> list:
         return self.intros.query(
             KeyConditionExpression='channel = :channel',
@@ -213,21 +239,98 @@ class Database(object):
         if not previous_intro:
             return
         
+        try:
+            self.intros.update_item(
+                Key={
+                    'channel': previous_intro['channel'],
+                    'date': previous_intro['date']
+                },
+                UpdateExpression='SET intros.#group_channel.happened = :happened',
+                ConditionExpression='attribute_exists(intros.#group_channel)',
+                ExpressionAttributeNames={
+                    '#group_channel': group_channel,
+                },
+                ExpressionAttributeValues={
+                    ':happened': happened
+                }
+            )
+        except self.intros.meta.client.exceptions.ConditionalCheckFailedException:
+            # The group is not part of the active round, e.g. an old survey button.
+            return
+        
+        return True
+
+    def record_intro_outcomes(self, channel: str, intro: dict) -> None:
+        if intro.get('outcomes_recorded'):
+            return
+        
+        # Every counter keeps the round it was last updated for and its value before that round, so a
+        # retry after a failed write, or an overlapping run, writes the same counts instead of adding twice.
+        counters = {i['user']: i for i in self._query_missed_intros(channel)}
+        
+        with self.missed_intros.batch_writer() as batch:
+            for group in intro['intros'].values():
+                for user in group['users']:
+                    counter = counters.get(user, {})
+                    if counter.get('round') == intro['date']:
+                        previous_missed_count = counter['previous_missed_count']
+                    else:
+                        previous_missed_count = counter.get('missed_count', 0)
+                    batch.put_item(Item={
+                        'channel': channel,
+                        'user': user,
+                        'missed_count': 0 if group['happened'] else previous_missed_count + 1,
+                        'previous_missed_count': previous_missed_count,
+                        'round': intro['date']
+                    })
+        
+        # Only mark the round once all counters are written.
         self.intros.update_item(
             Key={
-                'channel': previous_intro['channel'],
-                'date': previous_intro['date']
-            },
-            UpdateExpression='SET intros.#group_channel.happened = :happened',
-            ExpressionAttributeNames={
-                '#group_channel': group_channel,
+                'channel': intro['channel'],
+                'date': intro['date']
             },
-            ExpressionAttributeValues={
-                ':happened': happened
-            }
+            UpdateExpression='SET outcomes_recorded = :outcomes_recorded',
+            ExpressionAttributeValues={':outcomes_recorded': 1}
         )
+
+    def _query_missed_intros(self, channel: str) -> list[dict]:
+        query = {
+            'KeyConditionExpression': 'channel = :channel',
+            'ExpressionAttributeValues': {':channel': channel},
+            'ConsistentRead': True
+        }
+        response = self.missed_intros.query(**query)
+        items = response['Items']
+        while 'LastEvaluatedKey' in response:
+            response = self.missed_intros.query(**query, ExclusiveStartKey=response['LastEvaluatedKey'])
+            items.extend(response['Items'])
         
-        return True
+        return items
+
+    def get_missed_intros(self, channel: str) -> dict:
+        return {i['user']: i['missed_count'] for i in self._query_missed_intros(channel)}
+
+    def get_inactive_users(self, channel: str, min_missed_count: int) -> list[str]:
+        items = self.missed_intros.query(
+            KeyConditionExpression='channel = :channel',
+            FilterExpression='missed_count >= :min_missed_count',
+            ExpressionAttributeValues={
+                ':channel': channel,
+                ':min_missed_count': min_missed_count
+            },
+            ConsistentRead=True
+        )['Items']
+        
+        return [i['user'] for i in items]
+
+    def _reset_missed_intros(self, channel: str, users: list[str]) -> None:
+        with self.missed_intros.batch_writer() as batch:
+            for user in users:
+                batch.delete_item(Key={
+                    'channel': channel,
+                    'user': user
+                })
 
 
     def pause_intros(self, channel: str, user: str):
@@ -236,11 +339,20 @@ class Database(object):
             'user': user
         }) 
     
+    def pause_intros_for_users(self, channel: str, users: list[str]):
+        with self.paused_users.batch_writer() as batch:
+            for user in users:
+                batch.put_item(Item={
+                    'channel': channel,
+                    'user': user
+                })
+    
     def resume_intros(self, channel: str, user: str):
         self.paused_users.delete_item(Key={
             'channel': channel,
             'user': user
         }) 
+        self._reset_missed_intros(channel, [user])
     
     def get_paused_intros(self, channel: str):
         items = self.paused_users.query(
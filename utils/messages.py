@@ -32,6 +32,17 @@ def chats_scheduled_channel_message(n_pairs: int, previous_intros_stats: Optiona
     return {'text': message}
 
 
+def paused_due_to_inactivity_message(channel: str, missed_count: int) -> dict:
+    if missed_count == 1:
+        missed = 'your last coffee chat'
+    else:
+        missed = f'your last {({2: "two", 3: "three"}.get(missed_count, missed_count))} coffee chats'
+    
+    message = f'Coffee chats have been paused for you in <#{channel}> due to inactivity (missing {missed}). To be included in the next round, run `/coffee_chat resume` in the channel at any time.'
+    
+    return {'text': message}
+
+
 def ask_if_chat_happened_message(channel: str) -> dict:
     return {'blocks': [
         {
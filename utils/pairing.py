@@ -0,0 +1,77 @@
+import random
+from typing import Callable
+
+from utils.base_database import BaseDatabase
+
+
+def randomize_users(users: list[str]) -> list[list[str]]:
+    random.shuffle(users)
+
+    two_person_chats = users[:len(users)//2]
+    three_person_chats = users[len(users)//2:]
+
+    coffee_chats = []
+    leftovers = []
+
+    for i in range(0, len(three_person_chats), 3):
+        coffee_chat = three_person_chats[i:i+3]
+        if len(coffee_chat) == 3:
+            coffee_chats.append(coffee_chat)
+        else:
+            leftovers.extend(coffee_chat)
+    
+    for i in range(0, len(two_person_chats), 2):
+        coffee_chat = two_person_chats[i:i+2]
+        if len(coffee_chat) == 2:
+            coffee_chats.append(coffee_chat)
+        else:
+            leftovers.extend(coffee_chat)
+
+    if len(leftovers) == 1:
+        coffee_chats[-1].extend(leftovers)
+    if len(leftovers) > 1:
+        coffee_chats.append(leftovers)
+
+    return coffee_chats
+
+
+def get_recent_unmet_pairs(recent_intros: list) -> set[tuple]:
+    recent_paired_users = set()
+    for round in recent_intros:
+        for intro in round['intros'].values():
+            if not intro['happened']:
+                recent_paired_users.add(tuple(sorted(intro['users'])))
+
+    return recent_paired_users
+
+
+def pair_users(users: list[str], recent_paired_users: set[tuple], strategy: Callable[[list[str]], list[list[str]]] = randomize_users) -> list[list[str]]:
+    paired_users = strategy(users)
+
+    # Try again if repeat match.
+    repeat_match = False
+    for user_pair in paired_users:
+        if tuple(sorted(user_pair)) in recent_paired_users:
+            repeat_match = True
+            break
+    if repeat_match:
+        paired_users = strategy(users)
+
+    return paired_users
+
+
+def close_round(db: BaseDatabase, channel: str, recent_intros: list) -> None:
+    # Update the inactivity counters with the outcome of the round that is ending.
+    if recent_intros and recent_intros[0]['is_active']:
+        db.record_intro_outcomes(channel, recent_intros[0])
+
+
+def filter_users(db: BaseDatabase, channel: str, users: list[str], max_missed_intros: int) -> tuple[list[str], list[str]]:
+    paused_users = set(db.get_paused_intros(channel))
+    users = [u for u in users if u not in paused_users]
+
+    # Determine which users need to be skipped due to inactivity.
+    inactive_users = set(db.get_inactive_users(channel, max_missed_intros))
+    skipped_users = [u for u in users if u in inactive_users]
+
+    return [u for u in users if u not in inactive_users], skipped_users
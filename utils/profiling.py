@@ -0,0 +1,129 @@
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager
+from collections import defaultdict
+
+
+# Set when this module is imported, which should be first thing in lambda_function.
+IMPORT_STARTED = time.perf_counter()
+
+_import_time = None
+_cold_start = True
+_active = False
+_lock = threading.Lock()
+_phase_times = defaultdict(float)
+_phase_counts = defaultdict(int)
+_thread_profiles = []
+
+
+def is_enabled(event: dict = None) -> bool:
+    return os.environ.get('PROFILE', '').lower() in ('1', 'true') or bool((event or {}).get('profile'))
+
+
+def record_import_time() -> None:
+    global _import_time
+    _import_time = time.perf_counter() - IMPORT_STARTED
+
+
+@contextmanager
+def phase(name: str):
+    if not _active:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _phase_times[name] += time.perf_counter() - start
+            _phase_counts[name] += 1
+
+
+def profile_thread(func):
+    # Before Python 3.12, cProfile only sees the thread it was enabled in, so worker threads get
+    # their own profiler. From 3.12 it sees every thread, and a second profiler can't be started.
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _active or sys.version_info >= (3, 12):
+            return func(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            with _lock:
+                _thread_profiles.append(profiler)
+
+    return wrapper
+
+
+def profile_invocation(handler):
+    @wraps(handler)
+    def wrapper(event, context):
+        global _active, _cold_start
+
+        if not is_enabled(event):
+            _cold_start = False
+            return handler(event, context)
+
+        _phase_times.clear()
+        _phase_counts.clear()
+        _thread_profiles.clear()
+
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        _active = True
+        start = time.perf_counter()
+        try:
+            return profiler.runcall(handler, event, context)
+        finally:
+            duration = time.perf_counter() - start
+            _active = False
+            snapshot = tracemalloc.take_snapshot()
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            stats = pstats.Stats(profiler, stream=io.StringIO())
+            for thread_profiler in _thread_profiles:
+                stats.add(thread_profiler)
+
+            _log_summary(duration, stats, peak_memory, snapshot)
+
+            dump_dir = os.environ.get('PROFILE_DUMP_DIR')
+            if dump_dir:
+                request_id = getattr(context, 'aws_request_id', None) or int(time.time())
+                stats.dump_stats(f'{dump_dir}/profile-{request_id}.pstats')
+
+            _cold_start = False
+
+    return wrapper
+
+
+def _log_summary(duration: float, stats: pstats.Stats, peak_memory: int, snapshot: tracemalloc.Snapshot) -> None:
+    lines = [f'Profile: {duration * 1000:.0f} ms, peak memory {peak_memory / 1024:.0f} KiB']
+
+    if _cold_start and _import_time is not None:
+        lines.append(f'Import time (cold start): {_import_time * 1000:.0f} ms')
+
+    for name, phase_time in _phase_times.items():
+        lines.append(f'Phase {name}: {phase_time * 1000:.0f} ms over {_phase_counts[name]} calls')
+
+    # Top functions by cumulative time.
+    stats.stream = io.StringIO()
+    stats.sort_stats('cumulative').print_stats(15)
+    lines.append(stats.stream.getvalue().strip())
+
+    lines.append('Top allocations:')
+    for stat in snapshot.statistics('lineno')[:10]:
+        lines.append(f'  {stat}')
+
+    logging.info('\n'.join(lines))
@@ -6,10 +6,13 @@ import hmac
 import urllib.request
 import urllib.parse
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
+from utils.profiling import profile_thread
+
 
 def get_member_channels(client: WebClient) -> list[str]:
     try:
@@ -96,6 +99,39 @@ def send_message(client: WebClient, channel: str, message: dict) -> None:
         logging.error(f"Error sending message: {e.response['error']}")
 
 
+def send_messages(client: WebClient, messages: list[tuple[str, dict]], max_workers: int = 8) -> None:
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(profile_thread(lambda m: send_message(client, *m)), messages))
+
+
+def schedule_message(client: WebClient, channel: str, message: dict, post_at: int) -> str:
+    try:
+        response = client.chat_scheduleMessage(channel=channel, post_at=post_at, **message)
+        return response['scheduled_message_id']
+
+    except SlackApiError as e:
+        logging.error(f"Error scheduling message: {e.response['error']}")
+        return
+
+
+def schedule_messages(client: WebClient, messages: list[tuple[str, dict]], post_at: int, max_workers: int = 8) -> list[str]:
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(profile_thread(lambda m: schedule_message(client, *m, post_at)), messages))
+
+
+def delete_scheduled_message(client: WebClient, channel: str, scheduled_message_id: str) -> None:
+    try:
+        client.chat_deleteScheduledMessage(channel=channel, scheduled_message_id=scheduled_message_id)
+
+    except SlackApiError as e:
+        logging.error(f"Error deleting scheduled message: {e.response['error']}")
+
+
+def delete_scheduled_messages(client: WebClient, scheduled_messages: list[tuple[str, str]], max_workers: int = 8) -> None:
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(profile_thread(lambda m: delete_scheduled_message(client, *m)), scheduled_messages))
+
+
 def authenticate_new_install(code):
     
     url = 'https://slack.com/api/oauth.v2.access'
@@ -0,0 +1,310 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from utils.base_database import BaseDatabase
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS access_tokens (
+    team TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    added_dt TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS channels (
+    channel TEXT PRIMARY KEY,
+    added_dt TEXT NOT NULL,
+    frequency TEXT NOT NULL,
+    is_active INTEGER NOT NULL,
+    last_coffee_chat_dt TEXT,
+    last_engagement_asked_dt TEXT
+);
+
+CREATE TABLE IF NOT EXISTS intros (
+    channel TEXT NOT NULL,
+    date TEXT NOT NULL,
+    is_active INTEGER NOT NULL,
+    ice_break_question_id INTEGER,
+    outcomes_recorded INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (channel, date)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS intros_is_active_channel ON intros (channel) WHERE is_active = 1;
+
+CREATE TABLE IF NOT EXISTS intro_groups (
+    channel TEXT NOT NULL,
+    date TEXT NOT NULL,
+    group_channel TEXT NOT NULL,
+    users TEXT NOT NULL,
+    happened INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (channel, date, group_channel)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS planned_intros (
+    channel TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    ice_breaker TEXT NOT NULL,
+    intros TEXT NOT NULL,
+    added_users TEXT NOT NULL DEFAULT '[]'
+);
+
+CREATE TABLE IF NOT EXISTS ice_breaker_questions (
+    question_id INTEGER PRIMARY KEY,
+    question TEXT NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    times_used INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS ice_breaker_questions_is_active_times_used ON ice_breaker_questions (is_active, times_used);
+
+CREATE TABLE IF NOT EXISTS paused_users (
+    channel TEXT NOT NULL,
+    user TEXT NOT NULL,
+    PRIMARY KEY (channel, user)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS missed_intros (
+    channel TEXT NOT NULL,
+    user TEXT NOT NULL,
+    missed_count INTEGER NOT NULL,
+    PRIMARY KEY (channel, user)
+) WITHOUT ROWID;
+'''
+
+
+class SQLiteDatabase(BaseDatabase):
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self.connection as connection:
+            connection.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads, so every thread gets its own.
+        # Note that every connection to ':memory:' is a separate database.
+        if not hasattr(self._local, 'connection'):
+            connection = sqlite3.connect(self.path)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self._local.connection = connection
+        return self._local.connection
+
+
+    def save_access_token(self, team: str, access_token: str):
+        with self.connection as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO access_tokens (team, token, added_dt) VALUES (?, ?, ?)',
+                (team, access_token, datetime.now().date().isoformat())
+            )
+
+    def get_access_token(self, team: str) -> str:
+        row = self.connection.execute('SELECT token FROM access_tokens WHERE team = ?', (team,)).fetchone()
+        if row:
+            return row['token']
+
+    def get_installed_teams(self) -> list[str]:
+        return [row['team'] for row in self.connection.execute('SELECT team FROM access_tokens')]
+
+
+    def get_channel_settings(self, channel: str) -> dict:
+        row = self.connection.execute('SELECT * FROM channels WHERE channel = ?', (channel,)).fetchone()
+        if row:
+            return {**dict(row), 'is_active': bool(row['is_active'])}
+
+        return None
+
+    def save_channel_settings(self, channel_metadata: dict) -> None:
+        with self.connection as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO channels (channel, added_dt, frequency, is_active, last_coffee_chat_dt, last_engagement_asked_dt) '
+                'VALUES (:channel, :added_dt, :frequency, :is_active, :last_coffee_chat_dt, :last_engagement_asked_dt)',
+                channel_metadata
+            )
+
+
+    def get_ice_breaker_question(self) -> dict:
+        with self.connection as connection:
+            row = connection.execute(
+                'SELECT * FROM ice_breaker_questions WHERE is_active = 1 ORDER BY times_used LIMIT 1'
+            ).fetchone()
+
+            if row:
+                connection.execute(
+                    'UPDATE ice_breaker_questions SET times_used = times_used + 1 WHERE question_id = ?',
+                    (row['question_id'],)
+                )
+                return dict(row)
+
+        return {'question_id': -1, 'question': ''}
+
+
+    def _load_intro(self, row: sqlite3.Row) -> dict:
+        groups = self.connection.execute(
+            'SELECT group_channel, users, happened FROM intro_groups WHERE channel = ? AND date = ?',
+            (row['channel'], row['date'])
+        )
+
+        return {
+            **dict(row),
+            'intros': {
+                group['group_channel']: {
+                    'users': json.loads(group['users']),
+                    'happened': bool(group['happened'])
+                }
+                for group in groups
+            }
+        }
+
+    def get_active_intro(self, channel: str) -> dict:
+        row = self.connection.execute(
+            'SELECT * FROM intros WHERE channel = ? AND is_active = 1', (channel,)
+        ).fetchone()
+
+        if row:
+            return self._load_intro(row)
+
+        return None
+
+    def save_intros(self, channel: str, paired_users: list[list[str]], paired_group_channels: list[str], ice_breaker: dict, current_date: str = None):
+        current_date = current_date or datetime.today().date().isoformat()
+
+        with self.connection as connection:
+            # Set previous intros as inactive.
+            connection.execute('UPDATE intros SET is_active = 0 WHERE channel = ? AND is_active = 1', (channel,))
+
+            # Insert new intro record.
+            connection.execute(
+                'INSERT OR REPLACE INTO intros (channel, date, is_active, ice_break_question_id) VALUES (?, ?, 1, ?)',
+                (channel, current_date, ice_breaker['question_id'])
+            )
+            connection.execute('DELETE FROM intro_groups WHERE channel = ? AND date = ?', (channel, current_date))
+            connection.executemany(
+                'INSERT INTO intro_groups (channel, date, group_channel, users) VALUES (?, ?, ?, ?)',
+                [
+                    (channel, current_date, group_channel, json.dumps(users))
+                    for users, group_channel in zip(paired_users, paired_group_channels)
+                ]
+            )
+
+        self.get_or_update_channel_settings(channel, last_coffee_chat_dt=current_date)
+
+    def load_recent_intros(self, channel) -> list:
+        rows = self.connection.execute(
+            'SELECT * FROM intros WHERE channel = ? ORDER BY date DESC LIMIT 2', (channel,)
+        ).fetchall()
+
+        return [self._load_intro(row) for row in rows]
+
+    def update_intro_happened(self, channel: str, group_channel: str, happened: bool) -> str:
+        with self.connection as connection:
+            updated = connection.execute(
+                'UPDATE intro_groups SET happened = ? '
+                'WHERE channel = ? AND group_channel = ? AND date = (SELECT date FROM intros WHERE channel = ? AND is_active = 1)',
+                (happened, channel, group_channel, channel)
+            ).rowcount
+
+        # The group is not part of the active round, e.g. an old survey button.
+        if not updated:
+            return
+
+        return True
+
+
+    def save_planned_intros(self, channel: str, pairing_date: str, paired_users: list[list[str]], paired_group_channels: list[str], ice_breaker: dict, scheduled_message_ids: list[str]):
+        intros = {
+            group_channel: {
+                'users': users,
+                'scheduled_message_id': scheduled_message_id
+            }
+            for users, group_channel, scheduled_message_id in zip(paired_users, paired_group_channels, scheduled_message_ids)
+        }
+
+        with self.connection as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO planned_intros (channel, date, ice_breaker, intros) VALUES (?, ?, ?, ?)',
+                (channel, pairing_date, json.dumps({'question_id': ice_breaker['question_id'], 'question': ice_breaker['question']}), json.dumps(intros))
+            )
+
+    def get_planned_intros(self, channel: str) -> dict:
+        row = self.connection.execute('SELECT * FROM planned_intros WHERE channel = ?', (channel,)).fetchone()
+        if row:
+            return {
+                'channel': row['channel'],
+                'date': row['date'],
+                'ice_breaker': json.loads(row['ice_breaker']),
+                'intros': json.loads(row['intros']),
+                'added_users': json.loads(row['added_users'])
+            }
+
+        return None
+
+    def add_user_to_planned_intros(self, channel: str, user: str):
+        with self.connection as connection:
+            connection.execute(
+                "UPDATE planned_intros SET added_users = json_insert(added_users, '$[#]', ?) WHERE channel = ?",
+                (user, channel)
+            )
+
+    def delete_planned_intros(self, channel: str):
+        with self.connection as connection:
+            connection.execute('DELETE FROM planned_intros WHERE channel = ?', (channel,))
+
+
+    def record_intro_outcomes(self, channel: str, intro: dict) -> None:
+        with self.connection as connection:
+            # Claim the round first so retries and overlapping runs only count it once.
+            updated = connection.execute(
+                'UPDATE intros SET outcomes_recorded = 1 WHERE channel = ? AND date = ? AND outcomes_recorded = 0',
+                (intro['channel'], intro['date'])
+            ).rowcount
+            if not updated:
+                return
+
+            connection.execute(
+                'INSERT INTO missed_intros (channel, user, missed_count) '
+                'SELECT intro_groups.channel, users.value, 1 - intro_groups.happened '
+                'FROM intro_groups, json_each(intro_groups.users) AS users '
+                'WHERE intro_groups.channel = ? AND intro_groups.date = ? '
+                'ON CONFLICT (channel, user) DO UPDATE SET '
+                'missed_count = CASE WHEN excluded.missed_count = 0 THEN 0 ELSE missed_count + 1 END',
+                (intro['channel'], intro['date'])
+            )
+
+    def get_missed_intros(self, channel: str) -> dict:
+        rows = self.connection.execute('SELECT user, missed_count FROM missed_intros WHERE channel = ?', (channel,))
+        return {row['user']: row['missed_count'] for row in rows}
+
+    def get_inactive_users(self, channel: str, min_missed_count: int) -> list[str]:
+        rows = self.connection.execute(
+            'SELECT user FROM missed_intros WHERE channel = ? AND missed_count >= ?', (channel, min_missed_count)
+        )
+        return [row['user'] for row in rows]
+
+    def _reset_missed_intros(self, connection: sqlite3.Connection, channel: str, users: list[str]) -> None:
+        connection.executemany(
+            'DELETE FROM missed_intros WHERE channel = ? AND user = ?', [(channel, user) for user in users]
+        )
+
+
+    def pause_intros(self, channel: str, user: str):
+        self.pause_intros_for_users(channel, [user])
+
+    def pause_intros_for_users(self, channel: str, users: list[str]):
+        with self.connection as connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO paused_users (channel, user) VALUES (?, ?)', [(channel, user) for user in users]
+            )
+
+    def resume_intros(self, channel: str, user: str):
+        with self.connection as connection:
+            connection.execute('DELETE FROM paused_users WHERE channel = ? AND user = ?', (channel, user))
+            self._reset_missed_intros(connection, channel, [user])
+
+    def get_paused_intros(self, channel: str):
+        rows = self.connection.execute('SELECT user FROM paused_users WHERE channel = ?', (channel,))
+        return [row['user'] for row in rows]